@@ -7,8 +7,11 @@ TAG_AFFILIATION = BASE_TAG + 'affiliation'
 TAG_RESUMPTION_TOKEN = BASE_TAG_OAI + 'resumptionToken'
 TAG_SET_SPEC = BASE_TAG_OAI + 'set'
 AWS_S3_BUCKET = 'XXX' # replace XXX with bucket name
+STORAGE_DIR = None  # set to a local directory to use it instead of the S3 bucket
+EXPORT_DIR = '/tmp/arxiv_export'  # replace with the local directory for the snapshots of 'export_snapshots.py'
 DB_NAME = 'gendergap_db'
 DB_HOST = 'XXX'  # replace XXX with database host
 DB_PORT = 5432
+PARTITION_BY_YEAR = False  # True if the tables are partitioned by year, see 'prepare_database.py'
 DB_USER = 'gendergap_user'
 DB_PW = 'XXX'  # replace XXX with password
@@ -0,0 +1,107 @@
+from config import PARTITION_BY_YEAR
+from db_constants import TABLE_ARTICLE, TABLE_AUTHORSHIP, TABLE_AUTHOR_STATS, COLUMN_YEAR
+
+"""Maintenance of the aggregate table with author counts per first name, year, primary category and position"""
+
+# Contributions of the authorships of the selected articles to the aggregate table.
+# Authors with initials only have no first name, they are counted under the empty string.
+# The primary category is the first entry of the space-separated 'categories' column.
+# With tables partitioned by year, the join includes the partitioning column, so that matching partitions are joined.
+AUTHOR_STATS_SOURCE = """
+    SELECT COALESCE(au.first_name, '') AS first_name,
+           EXTRACT(YEAR FROM ar.created)::INTEGER AS year,
+           split_part(ar.categories, ' ', 1) AS primary_category,
+           CASE
+               WHEN au.n_authors = 1 THEN 'single'
+               WHEN au.author_pos = 1 THEN 'first'
+               WHEN au.author_pos = au.n_authors THEN 'last'
+               ELSE 'middle'
+           END AS author_position,
+           COUNT(*) AS author_count
+      FROM (SELECT article_id, author_pos, first_name{year_col},
+                   COUNT(*) OVER (PARTITION BY article_id) AS n_authors
+              FROM {authorship}
+              {where}) au
+      JOIN {articles} ar ON ar.identifier = au.article_id{year_join}
+     GROUP BY 1, 2, 3, 4
+"""
+
+KEY_COLUMNS = ('first_name', 'year', 'primary_category', 'author_position')
+
+# Changes of a transaction are collected in this temporary table and applied at its end,
+# see 'apply_author_stats'.
+TABLE_AUTHOR_STATS_DELTA = 'author_stats_delta'
+
+# Key of the transaction level advisory lock serializing updates of the aggregate table.
+# Concurrent importers would otherwise risk deadlocks when updating the same rows in different order.
+LOCK_AUTHOR_STATS = 26001
+
+
+def author_stats_source(restrict_to_ids=False):
+    where = 'WHERE article_id = ANY(%(ids)s)' if restrict_to_ids else ''
+    year_col, year_join = (f', {COLUMN_YEAR}', f' AND ar.{COLUMN_YEAR} = au.{COLUMN_YEAR}') if PARTITION_BY_YEAR \
+        else ('', '')
+    return AUTHOR_STATS_SOURCE.format(authorship=TABLE_AUTHORSHIP, articles=TABLE_ARTICLE, where=where,
+                                      year_col=year_col, year_join=year_join)
+
+
+def stage_author_stats(cursor, ids, sign):
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE IF NOT EXISTS {TABLE_AUTHOR_STATS_DELTA} (
+            first_name VARCHAR, year INTEGER, primary_category VARCHAR, author_position VARCHAR,
+            author_count INTEGER
+        ) ON COMMIT DROP
+        """)
+    cols = ', '.join(KEY_COLUMNS)
+    cursor.execute(f"""
+        INSERT INTO {TABLE_AUTHOR_STATS_DELTA} ({cols}, author_count)
+        SELECT {cols}, %(sign)s * author_count
+          FROM ({author_stats_source(restrict_to_ids=True)}) src
+        """, {'ids': list(ids), 'sign': sign})
+
+
+def subtract_author_stats(cursor, ids):
+    """Stage the removal of the contributions of the articles 'ids' currently stored in the database.
+    Must be called before these articles are deleted, in the same transaction as 'apply_author_stats'."""
+    stage_author_stats(cursor, ids, -1)
+
+
+def add_author_stats(cursor, ids):
+    """Stage the contributions of the articles 'ids' after they have been inserted into the database.
+    Must be called in the same transaction as 'apply_author_stats'."""
+    stage_author_stats(cursor, ids, 1)
+
+
+def apply_author_stats(cursor):
+    """Apply the staged changes to the aggregate table. The lock is held until the end of the transaction,
+    so this should be the last statement before the commit."""
+    cols = ', '.join(KEY_COLUMNS)
+    cursor.execute("""SELECT pg_advisory_xact_lock(%s)""", (LOCK_AUTHOR_STATS,))
+    cursor.execute(f"""
+        INSERT INTO {TABLE_AUTHOR_STATS} ({cols}, author_count)
+        SELECT {cols}, SUM(author_count)
+          FROM {TABLE_AUTHOR_STATS_DELTA}
+         GROUP BY {cols}
+        HAVING SUM(author_count) <> 0
+         ORDER BY {cols}
+        ON CONFLICT ({cols}) DO UPDATE
+            SET author_count = {TABLE_AUTHOR_STATS}.author_count + EXCLUDED.author_count
+        """)
+    key_match = ' AND '.join(f's.{col} = d.{col}' for col in KEY_COLUMNS)
+    cursor.execute(f"""
+        DELETE FROM {TABLE_AUTHOR_STATS} s
+         USING {TABLE_AUTHOR_STATS_DELTA} d
+         WHERE {key_match} AND s.author_count <= 0
+        """)
+    cursor.execute(f"""TRUNCATE {TABLE_AUTHOR_STATS_DELTA}""")
+
+
+def refresh_author_stats(cursor):
+    """Rebuild the aggregate table from scratch."""
+    cols = ', '.join(KEY_COLUMNS)
+    cursor.execute("""SELECT pg_advisory_xact_lock(%s)""", (LOCK_AUTHOR_STATS,))
+    cursor.execute(f"""TRUNCATE {TABLE_AUTHOR_STATS}""")
+    cursor.execute(f"""
+        INSERT INTO {TABLE_AUTHOR_STATS} ({cols}, author_count)
+        {author_stats_source()}
+        """)
@@ -1,8 +1,20 @@
 TABLE_ARTICLE = 'arxiv_articles'
 TABLE_AUTHORSHIP = 'arxiv_authorship'
-TABLE_AFFILIATION = 'arxiv_affiliations'
+TABLE_AFFILIATION = 'arxiv_affiliations'  # view on author affiliations and names with the columns COLUMNS_AFFILIATIONS
+TABLE_AUTHOR_AFFILIATIONS = 'arxiv_author_affiliations'
+TABLE_AFFILIATION_NAMES = 'arxiv_affiliation_names'
+TABLE_AUTHOR_STATS = 'arxiv_author_stats'
+TABLE_CATEGORIES = 'arxiv_article_categories'
+TABLE_IMPORT_LEASES = 'arxiv_import_leases'
+TABLE_IMPORT_LEDGER = 'arxiv_import_ledger'
+TABLE_EXPORT_CHANGES = 'arxiv_export_changes'
+
+COLUMN_YEAR = 'article_year'  # partitioning column of the tables partitioned by year
 
 COLUMNS_ARTICLES = ['identifier', 'title', 'created', 'categories', 'datestamp', 'set_spec', 'abstract',
                     'msc_class', 'acm_class', 'comments', 'updated', 'journal_ref', 'report_no', 'doi']
 COLUMNS_AUTHORSHIP = ['article_id', 'author_pos', 'keyname', 'forenames', 'suffix', 'first_name', 'middle_name']
 COLUMNS_AFFILIATIONS = ['article_id', 'author_pos', 'affiliation']
+COLUMNS_AUTHOR_AFFILIATIONS = ['article_id', 'author_pos', 'affiliation_name_id']
+COLUMNS_CATEGORIES = ['article_id', 'category', 'archive', 'is_primary']
+COLUMNS_LEDGER_COUNTS = ['n_deleted', 'n_articles', 'n_authorships', 'n_affiliations']
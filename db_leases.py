@@ -0,0 +1,77 @@
+import os
+import socket
+import uuid
+
+from db_constants import TABLE_IMPORT_LEASES
+
+"""Leases on shards of the identifier space, coordinating concurrent importers via the database"""
+
+# A lease not renewed within this interval is considered abandoned (e.g. the worker crashed)
+# and can be taken over by another worker. It must exceed the time needed to import one file.
+LEASE_DURATION = '30 minutes'
+
+
+class LeaseLostError(Exception):
+    """Raised when a worker no longer holds a lease it expects to hold."""
+
+
+def worker_name():
+    return '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+def ensure_shards(cursor, n_shards):
+    cursor.execute(f"""
+        INSERT INTO {TABLE_IMPORT_LEASES} (shard)
+        SELECT generate_series(0, %s - 1)
+        ON CONFLICT (shard) DO NOTHING
+        """, (n_shards,))
+
+
+def acquire_leases(cursor, worker, n_shards, max_shards):
+    """Acquire leases on at most 'max_shards' shards which are free or whose lease has expired.
+    Shards released longest ago are preferred, so that workers handling only some of the shards
+    take turns on all of them. Returns the list of acquired shards."""
+    cursor.execute(f"""
+        UPDATE {TABLE_IMPORT_LEASES}
+           SET worker = %(worker)s, lease_expires = now() + %(duration)s::INTERVAL
+         WHERE shard IN (SELECT shard
+                           FROM {TABLE_IMPORT_LEASES}
+                          WHERE shard < %(n_shards)s
+                            AND (worker IS NULL OR lease_expires < now())
+                          ORDER BY lease_expires NULLS FIRST, shard
+                          LIMIT %(max_shards)s
+                            FOR UPDATE SKIP LOCKED)
+        RETURNING shard
+        """, {'worker': worker, 'duration': LEASE_DURATION, 'n_shards': n_shards, 'max_shards': max_shards})
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+def renew_leases(cursor, worker, shards):
+    """Lock the lease rows of 'shards' until the end of the transaction and extend them.
+    Raises LeaseLostError if one of them has expired or was taken over by another worker,
+    in which case the transaction must be rolled back. Since the rows stay locked, no other worker
+    can take over the shards before the transaction is committed."""
+    cursor.execute(f"""
+        SELECT shard
+          FROM {TABLE_IMPORT_LEASES}
+         WHERE shard = ANY(%s) AND worker = %s AND lease_expires > now()
+         ORDER BY shard
+           FOR UPDATE
+        """, (list(shards), worker))
+    held = {row[0] for row in cursor.fetchall()}
+    if held != set(shards):
+        raise LeaseLostError('Worker {} lost the leases on shards {}.'.format(worker, sorted(set(shards) - held)))
+    cursor.execute(f"""
+        UPDATE {TABLE_IMPORT_LEASES}
+           SET lease_expires = now() + %s::INTERVAL
+         WHERE shard = ANY(%s) AND worker = %s
+        """, (LEASE_DURATION, list(shards), worker))
+
+
+def release_leases(cursor, worker, shards):
+    """The time of the release is kept in 'lease_expires', see 'acquire_leases'."""
+    cursor.execute(f"""
+        UPDATE {TABLE_IMPORT_LEASES}
+           SET worker = NULL, lease_expires = now()
+         WHERE shard = ANY(%s) AND worker = %s
+        """, (list(shards), worker))
@@ -0,0 +1,28 @@
+from db_constants import TABLE_ARTICLE
+
+"""Full-text search over titles and abstracts of the articles"""
+
+TEXT_SEARCH_CONFIG = 'english'
+
+# Matches in the title weigh more than matches in the abstract
+SEARCH_VECTOR = f"""
+    setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', COALESCE(title, '')), 'A') ||
+    setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', COALESCE(abstract, '')), 'B')
+"""
+
+
+def search_articles(cursor, query, limit=1000):
+    """
+    Return identifiers and ranks of the articles matching all words of 'query', best matches first.
+    Example:
+        search_articles(cursor, 'gravitational waves', limit=2)
+        >>>[('1602.03837', 0.99), ('1710.05832', 0.98)]
+    """
+    cursor.execute(f"""
+        SELECT identifier, ts_rank(search_vector, query) AS rank
+          FROM {TABLE_ARTICLE}, plainto_tsquery('{TEXT_SEARCH_CONFIG}', %s) query
+         WHERE search_vector @@ query
+         ORDER BY rank DESC, identifier
+         LIMIT %s
+        """, (query, limit))
+    return cursor.fetchall()
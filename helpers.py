@@ -1,4 +1,5 @@
 import re
+import zlib
 
 """Methods for name part extraction"""
 
@@ -54,3 +55,32 @@ def replace_umlauts(s):
         for k, v in umlaute.items():
             s = k.sub(v, s)
     return s
+
+
+"""Methods for arXiv categories"""
+
+
+def split_categories(categories):
+    """
+    Split the space-separated 'categories' of an article into tuples (category, archive, is_primary).
+    The first category is the primary one, duplicates are ignored.
+    Example:
+        split_categories('math.AG hep-th math.AG')
+        >>>[('math.AG', 'math', True), ('hep-th', 'hep-th', False)]
+    """
+    if not isinstance(categories, str):
+        return []
+
+    result = []
+    for category in categories.split():
+        if category not in (c for c, _, _ in result):
+            result.append((category, category.split('.')[0], len(result) == 0))
+    return result
+
+
+"""Methods for the partitioning of the import"""
+
+
+def shard_of(identifier, n_shards):
+    """Return the shard (0 <= shard < n_shards) of an article. All versions of an article belong to the same shard."""
+    return zlib.crc32(str(identifier).encode('utf-8')) % n_shards
@@ -0,0 +1,162 @@
+import abc
+import codecs
+import os
+import shutil
+from collections import namedtuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+from config import AWS_S3_BUCKET, STORAGE_DIR
+
+StoredObject = namedtuple('StoredObject', ['key', 'etag', 'size'])
+
+
+class ObjectStore(abc.ABC):
+    """Storage of the files exchanged between harvester and importer.
+    Keys are paths relative to the root of the store with '/' as separator, e.g. 'metadata/2018-01-01_0.json'."""
+
+    @abc.abstractmethod
+    def put(self, key, body):
+        """Stores 'body' (str or bytes) under 'key', replacing an existing object."""
+
+    @abc.abstractmethod
+    def open(self, key):
+        """Returns a binary file-like object for reading the object 'key'.
+        Raises FileNotFoundError if it does not exist."""
+
+    def open_text(self, key, encoding='utf-8'):
+        return codecs.getreader(encoding)(self.open(key))
+
+    @abc.abstractmethod
+    def exists(self, key):
+        """Returns whether the object 'key' exists."""
+
+    @abc.abstractmethod
+    def list_objects(self, prefix):
+        """Returns StoredObjects for the keys starting with 'prefix' in lexicographical order,
+        without those in sub-"directories"."""
+
+    def list(self, prefix):
+        return [obj.key for obj in self.list_objects(prefix)]
+
+    @abc.abstractmethod
+    def copy(self, key, target_key):
+        """Copies the object 'key' to 'target_key'. Raises FileNotFoundError if it does not exist."""
+
+    @abc.abstractmethod
+    def delete(self, keys):
+        """Deletes the objects 'keys', ignoring those which do not exist."""
+
+
+class S3Store(ObjectStore):
+    """Objects in an AWS S3 bucket."""
+
+    MAX_KEYS_PER_DELETE = 1000  # limit of S3 for a single 'delete_objects' request
+
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self.s3 = boto3.resource('s3')
+        self.bucket = self.s3.Bucket(bucket_name)
+        self.client = boto3.client('s3')
+
+    def put(self, key, body):
+        self.bucket.put_object(Key=key, Body=body)
+
+    def open(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket_name, Key=key)['Body']
+        except ClientError as e:
+            if is_not_found(e):
+                raise FileNotFoundError('Object "{}" not found in bucket "{}".'.format(key, self.bucket_name))
+            raise
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if is_not_found(e):
+                return False
+            raise
+        return True
+
+    def list_objects(self, prefix):
+        return [StoredObject(obj.key, obj.e_tag.strip('"'), obj.size)
+                for obj in self.bucket.objects.filter(Prefix=prefix, Delimiter='/')]
+
+    def copy(self, key, target_key):
+        try:
+            self.s3.Object(self.bucket_name, target_key).copy_from(CopySource=self.bucket_name + '/' + key)
+        except ClientError as e:
+            if is_not_found(e):
+                raise FileNotFoundError('Object "{}" not found in bucket "{}".'.format(key, self.bucket_name))
+            raise
+
+    def delete(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), self.MAX_KEYS_PER_DELETE):
+            objects = [{'Key': key} for key in keys[i:i + self.MAX_KEYS_PER_DELETE]]
+            self.bucket.delete_objects(Delete={'Objects': objects, 'Quiet': True})
+
+
+class LocalStore(ObjectStore):
+    """Objects as files below a local directory. Puts and copies are atomic within one file system."""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def path(self, key):
+        return os.path.join(self.root_dir, *key.split('/'))
+
+    def put(self, key, body):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(body.encode('utf-8') if isinstance(body, str) else body)
+        os.replace(tmp_path, path)
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def list_objects(self, prefix):
+        """The ETag of a file is derived from its modification time and size instead of its content."""
+        folder, _, name_prefix = prefix.rpartition('/')
+        directory = self.path(folder) if folder else self.root_dir
+        if not os.path.isdir(directory):
+            return []
+        objects = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.startswith(name_prefix) and not name.endswith('.tmp') and os.path.isfile(path):
+                stat = os.stat(path)
+                objects.append(StoredObject((folder + '/' if folder else '') + name,
+                                            '{:x}-{:x}'.format(stat.st_mtime_ns, stat.st_size), stat.st_size))
+        return objects
+
+    def copy(self, key, target_key):
+        target_path = self.path(target_key)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.copyfile(self.path(key), target_path + '.tmp')
+        os.replace(target_path + '.tmp', target_path)
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+
+def is_not_found(client_error):
+    return client_error.response['ResponseMetadata']['HTTPStatusCode'] == 404
+
+
+def get_store():
+    """Returns the store configured in 'config.py': the local directory STORAGE_DIR if set, the S3 bucket otherwise."""
+    if STORAGE_DIR:
+        return LocalStore(STORAGE_DIR)
+    return S3Store(AWS_S3_BUCKET)
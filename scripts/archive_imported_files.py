@@ -0,0 +1,70 @@
+# Remove files from the store which have been imported for all shards according to the import ledger.
+# Files are matched by key and ETag, so a file rewritten after its import is kept until the new contents are imported.
+# The importer does not depend on this step, it skips files found in the ledger. Run it e.g. once a day
+# to keep the listings short. By default the files are copied to the archive folders first,
+# with '--delete' (or {"delete_only": true} as Lambda event) they are only deleted.
+
+import sys
+from datetime import datetime
+
+import psycopg2
+
+from config import DB_USER, DB_PW, DB_HOST, DB_PORT, DB_NAME
+from db_constants import TABLE_IMPORT_LEDGER
+from object_store import get_store
+from scripts.import_file_to_db import N_SHARDS, PREFIX_FILE, PREFIX_FILE_DELETIONS
+
+ARCHIVE_FOLDER = 'finished_metadata/'
+ARCHIVE_FOLDER_DELETIONS = 'finished_missing_metadata/'
+
+STORE = get_store()
+
+
+def finished_files(objects):
+    """Returns the keys of the StoredObjects 'objects' whose current contents have been imported for all shards."""
+    if len(objects) == 0:
+        return set()
+    conn = None
+    try:
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PW)
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT file_key, etag FROM {TABLE_IMPORT_LEDGER}
+             WHERE file_key = ANY(%s)
+             GROUP BY file_key, etag
+            HAVING COUNT(*) = %s
+            """, ([obj.key for obj in objects], N_SHARDS))
+        imported = set(cur.fetchall())
+        finished = {obj.key for obj in objects if (obj.key, obj.etag) in imported}
+        cur.close()
+    finally:
+        if conn is not None:
+            conn.close()
+    return finished
+
+
+def archive_imported_files(prefix, folder, delete_only=False):
+    s = datetime.now()
+    objects = STORE.list_objects(prefix)
+    finished_keys = finished_files(objects)
+    finished = [obj.key for obj in objects if obj.key in finished_keys]
+    if not delete_only:
+        for key in finished:
+            STORE.copy(key, folder + key.split('/')[-1])
+    STORE.delete(finished)
+    print('{} elapsed for archiving {} of {} files with prefix {}'.format(datetime.now() - s, len(finished),
+                                                                          len(objects), prefix))
+
+
+def archive_all(delete_only=False):
+    archive_imported_files(PREFIX_FILE, ARCHIVE_FOLDER, delete_only)
+    archive_imported_files(PREFIX_FILE_DELETIONS, ARCHIVE_FOLDER_DELETIONS, delete_only)
+
+
+def lambda_handler(event, context):
+    """lambda handler syntax; requires event and context variables"""
+    archive_all((event or {}).get('delete_only', False))
+
+
+if __name__ == '__main__':
+    archive_all('--delete' in sys.argv[1:])
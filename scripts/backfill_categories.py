@@ -0,0 +1,36 @@
+# Fill the table 'arxiv_article_categories' for articles imported before the table existed.
+# The table and its indexes are created first if they do not exist yet.
+# Articles that already have categories are skipped, so the script can be run repeatedly.
+# The result is the same as the one of 'split_categories' in 'helpers.py', which is used by the importer.
+
+from datetime import datetime
+
+from config import DB_HOST, DB_PORT, DB_NAME
+from config_db_admin import DB_ADMIN_PW, DB_ADMIN_USER
+from db_helpers import execute_commands
+from scripts.prepare_database import CREATE_ARTICLE_CATEGORIES, CREATE_ARTICLE_CATEGORIES_INDEXES, \
+    grant_to_non_admin_user
+
+
+def backfill_categories():
+    commands = (CREATE_ARTICLE_CATEGORIES,) + CREATE_ARTICLE_CATEGORIES_INDEXES + (
+        r"""
+        INSERT INTO arxiv_article_categories (article_id, category, archive, is_primary)
+        SELECT DISTINCT ON (a.identifier, c.category)
+               a.identifier, c.category, split_part(c.category, '.', 1), c.pos = 1
+          FROM arxiv_articles a,
+               regexp_split_to_table(trim(a.categories), '\s+') WITH ORDINALITY AS c(category, pos)
+         WHERE c.category <> ''
+           AND NOT EXISTS (SELECT 1 FROM arxiv_article_categories ac WHERE ac.article_id = a.identifier)
+         ORDER BY a.identifier, c.category, c.pos
+        """,
+        """ANALYZE arxiv_article_categories""",
+    )
+    s = datetime.now()
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
+    print('{} elapsed for backfill of article categories'.format(datetime.now() - s))
+    grant_to_non_admin_user()
+
+
+if __name__ == '__main__':
+    backfill_categories()
@@ -0,0 +1,69 @@
+# Add the full-text search column to an existing table 'arxiv_articles' and compute it for all articles.
+# Articles are updated in chunks along the primary key, each chunk in its own transaction,
+# so the table stays usable and the script can be interrupted and resumed from the printed identifier.
+# The GIN index is created after the backfill, which is much faster than updating it row by row.
+# The importer writes the column, so it must exist before the new importer is deployed: run the script with
+# '--add-column' first, which only adds the (empty) column, and the backfill at any time afterwards.
+
+import sys
+from datetime import datetime
+
+from config import DB_HOST, DB_PORT, DB_NAME
+from config_db_admin import DB_ADMIN_PW, DB_ADMIN_USER
+from db_helpers import open_connection, close_connection, execute_commands
+from db_search import SEARCH_VECTOR
+
+CHUNK_SIZE = 10000
+
+
+def add_search_column():
+    commands = (
+        """ALTER TABLE arxiv_articles ADD COLUMN IF NOT EXISTS search_vector TSVECTOR""",
+    )
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
+
+
+def backfill_search_vector(start_after=''):
+    conn, cursor = open_connection(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW)
+    try:
+        last_identifier = start_after
+        while True:
+            s = datetime.now()
+            cursor.execute(f"""
+                WITH chunk AS (
+                    SELECT identifier FROM arxiv_articles
+                     WHERE identifier > %s
+                     ORDER BY identifier
+                     LIMIT %s)
+                UPDATE arxiv_articles
+                   SET search_vector = {SEARCH_VECTOR}
+                  FROM chunk
+                 WHERE arxiv_articles.identifier = chunk.identifier
+                RETURNING arxiv_articles.identifier
+                """, (last_identifier, CHUNK_SIZE))
+            identifiers = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            if len(identifiers) == 0:
+                break
+            last_identifier = max(identifiers)
+            print('  {} elapsed for {} articles up to {}'.format(datetime.now() - s, len(identifiers), last_identifier))
+    finally:
+        close_connection(conn)
+
+
+def create_search_index():
+    commands = (
+        """
+        CREATE INDEX IF NOT EXISTS article_search_idx
+            ON public.arxiv_articles USING GIN (search_vector)
+        """,
+        """ANALYZE arxiv_articles""",
+    )
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
+
+
+if __name__ == '__main__':
+    add_search_column()
+    if sys.argv[1:] != ['--add-column']:
+        backfill_search_vector(sys.argv[1] if len(sys.argv) > 1 else '')
+        create_search_index()
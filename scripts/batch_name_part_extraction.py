@@ -11,6 +11,7 @@ from config import DB_HOST, DB_PORT, DB_NAME
 from config_db_admin import DB_ADMIN_PW, DB_ADMIN_USER
 from db_helpers import open_connection, close_connection, execute_commands
 from helpers import extract_first_and_middle_name, replace_umlauts
+from scripts.refresh_aggregates import refresh_aggregates
 
 ENGINE = create_engine('postgresql://%s:%s@%s:%s/%s' % (DB_ADMIN_USER, DB_ADMIN_PW, DB_HOST, DB_PORT, DB_NAME))
 
@@ -90,6 +91,9 @@ if __name__ == '__main__':
 
     update_authorship_table()
     print("Updated authorship table")
+
+    refresh_aggregates()  # aggregates are grouped by first name
+    print("Refreshed aggregate tables")
     # drop_tmp_table()
 
     close_connection(db_conn)
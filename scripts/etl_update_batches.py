@@ -3,19 +3,17 @@ import time
 from datetime import date, timedelta
 from urllib.parse import urlencode
 
-import boto3
 from dateutil import parser
 
 from arxiv_xml import ArxivXML
-from config import BASE_URL, AWS_S3_BUCKET
+from config import BASE_URL
+from object_store import get_store
 
 DELAY = 11
 KEY_LAST_BATCH_DATE = 'last_batch_date.txt'
-LOCAL_BUFFER_DIR = "/tmp/"
-FILE_LAST_BATCH_DATE = LOCAL_BUFFER_DIR + KEY_LAST_BATCH_DATE
 YESTERDAY = date.today() - timedelta(days=1)
 
-BUCKET = boto3.resource('s3').Bucket(AWS_S3_BUCKET)
+STORE = get_store()
 
 
 def build_url(batch_date, resumption_token=None):
@@ -32,14 +30,15 @@ def build_url(batch_date, resumption_token=None):
         return BASE_URL + '?verb=ListRecords&resumptionToken=' + resumption_token
 
 
-def dump_json_to_s3(data, file_name):
-    print(f'Storing file {file_name} to bucket {AWS_S3_BUCKET}')
-    BUCKET.put_object(Key=file_name, Body=json.dumps(data))
+def dump_json_to_store(data, file_name):
+    print(f'Storing file {file_name}')
+    STORE.put(file_name, json.dumps(data))
 
 
 def fetch_data(batch_date, resumption_token=None):
     """Creates an ArxivXML object containing at most 1000 metadata records.
-    Processes the retrieved records and dumps the object attributes to files in S3 whose names contain the batch date.
+    Processes the retrieved records and dumps the object attributes to files in the store
+    whose names contain the batch date.
     Returns resumption token from the XML which indicates whether the data retrieved was complete."""
     arxiv_xml = ArxivXML()
     url = build_url(batch_date, resumption_token=resumption_token)
@@ -47,9 +46,9 @@ def fetch_data(batch_date, resumption_token=None):
     arxiv_xml.process_xml(url)
     suffix = batch_suffix(resumption_token)
     if len(arxiv_xml.metadata) > 0:
-        dump_json_to_s3(arxiv_xml.metadata, f'metadata/{batch_date}_{suffix}.json')
+        dump_json_to_store(arxiv_xml.metadata, f'metadata/{batch_date}_{suffix}.json')
     if len(arxiv_xml.missing_metadata) > 0:
-        dump_json_to_s3(arxiv_xml.missing_metadata, f'missing_metadata/{batch_date}_{suffix}.json')
+        dump_json_to_store(arxiv_xml.missing_metadata, f'missing_metadata/{batch_date}_{suffix}.json')
     return arxiv_xml.resumption_token
 
 
@@ -69,8 +68,7 @@ def batch_suffix(resumption_token):
 
 
 def calc_batch_date():
-    BUCKET.download_file(KEY_LAST_BATCH_DATE, FILE_LAST_BATCH_DATE)
-    with open(FILE_LAST_BATCH_DATE, 'r') as fp:
+    with STORE.open_text(KEY_LAST_BATCH_DATE) as fp:
         date_string = fp.readline().strip()
     last_batch_date = parser.parse(date_string).date()
     if last_batch_date < YESTERDAY:
@@ -82,7 +80,7 @@ def calc_batch_date():
 
 
 def store_batch_date(batch_date):
-    boto3.resource('s3').Object(AWS_S3_BUCKET, KEY_LAST_BATCH_DATE).put(Body=str.encode(batch_date))
+    STORE.put(KEY_LAST_BATCH_DATE, str.encode(batch_date))
 
 
 def my_handler(event, context):
@@ -96,7 +94,8 @@ def my_handler(event, context):
 if __name__ == '__main__':
     f"""Fetches metadata updates from Arxiv on a daily basis. Each batch contains the changes from one day.
        A batch can consist of multiple files, containing max 1000 records each.
-       Which day had been fetched last is stored in the file {KEY_LAST_BATCH_DATE} in the AWS bucket {AWS_S3_BUCKET}.
+       Which day had been fetched last is stored in the file {KEY_LAST_BATCH_DATE} in the store (AWS bucket or
+       local directory, see 'config.py').
        To fetch all data, store a date like '1900-01-01' in this file. 
     """
     next_batch_date = calc_batch_date()
@@ -0,0 +1,192 @@
+# Export columnar snapshots of articles, authorships and affiliations as Parquet files for analyses,
+# so that notebooks can read local files instead of querying the production database.
+# The files are partitioned by the year of 'created':
+#     <EXPORT_DIR>/<table>/year=<year>/data.parquet
+# and can be read e.g. with pandas.read_parquet('<EXPORT_DIR>/authorship') or pyarrow.parquet.ParquetDataset,
+# filtering on 'year' without reading other partitions.
+# The first run exports all years. Afterwards only the partitions of the years in which the importer inserted
+# or deleted articles since the previous run are rewritten; the importer records them in 'arxiv_export_changes'.
+# Use '--full' to export all years again. Partitions are replaced one by one, so readers always find all years.
+
+import json
+import os
+import shutil
+import sys
+from datetime import date, datetime
+
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import DB_USER, DB_PW, DB_HOST, DB_PORT, DB_NAME, EXPORT_DIR, PARTITION_BY_YEAR
+from db_constants import COLUMNS_ARTICLES, COLUMNS_AUTHORSHIP, TABLE_ARTICLE, TABLE_AUTHORSHIP, \
+    TABLE_AUTHOR_AFFILIATIONS, TABLE_AFFILIATION_NAMES, TABLE_EXPORT_CHANGES, COLUMN_YEAR
+
+FILE_EXPORT_STATE = os.path.join(EXPORT_DIR, '_export_state.json')
+
+DATE_COLUMNS = ['created', 'datestamp', 'updated']
+INTEGER_COLUMNS = ['author_pos', 'affiliation_name_id']
+
+COLUMNS_EXPORT_AFFILIATIONS = ['article_id', 'author_pos', 'affiliation_name_id', 'affiliation']
+
+# With tables partitioned by year, the queries filter and join on the partitioning column as well,
+# so that PostgreSQL reads only the partitions of the exported year
+YEAR_FILTER = f' AND ar.{COLUMN_YEAR} = %(year)s' if PARTITION_BY_YEAR else ''
+YEAR_JOIN = f' AND ar.{COLUMN_YEAR} = {{alias}}.{COLUMN_YEAR}' if PARTITION_BY_YEAR else ''
+
+# queries per exported table, restricted to the articles created in [begin, end), i.e. in 'year'.
+# Affiliations are read from the base tables, the view 'arxiv_affiliations' has no partitioning column.
+EXPORT_QUERIES = {
+    'articles': """
+        SELECT {cols} FROM {articles} ar
+         WHERE ar.created >= %(begin)s AND ar.created < %(end)s{year_filter}
+         ORDER BY ar.identifier
+        """.format(cols=', '.join('ar.' + col for col in COLUMNS_ARTICLES), articles=TABLE_ARTICLE,
+                   year_filter=YEAR_FILTER),
+    'authorship': """
+        SELECT {cols} FROM {authorship} au
+          JOIN {articles} ar ON ar.identifier = au.article_id{year_join}
+         WHERE ar.created >= %(begin)s AND ar.created < %(end)s{year_filter}
+         ORDER BY au.article_id, au.author_pos
+        """.format(cols=', '.join('au.' + col for col in COLUMNS_AUTHORSHIP), authorship=TABLE_AUTHORSHIP,
+                   articles=TABLE_ARTICLE, year_join=YEAR_JOIN.format(alias='au'), year_filter=YEAR_FILTER),
+    'affiliations': """
+        SELECT aa.article_id, aa.author_pos, aa.affiliation_name_id, an.affiliation FROM {author_affiliations} aa
+          JOIN {names} an ON an.affiliation_name_id = aa.affiliation_name_id
+          JOIN {articles} ar ON ar.identifier = aa.article_id{year_join}
+         WHERE ar.created >= %(begin)s AND ar.created < %(end)s{year_filter}
+         ORDER BY aa.article_id, aa.author_pos, aa.affiliation_id
+        """.format(author_affiliations=TABLE_AUTHOR_AFFILIATIONS, names=TABLE_AFFILIATION_NAMES, articles=TABLE_ARTICLE,
+                   year_join=YEAR_JOIN.format(alias='aa'), year_filter=YEAR_FILTER),
+}
+
+
+def arrow_schema(columns):
+    """Explicit schema, so that all partitions have the same one even if a column contains only NULLs"""
+    fields = []
+    for col in columns:
+        if col in DATE_COLUMNS:
+            fields.append(pa.field(col, pa.date32()))
+        elif col in INTEGER_COLUMNS:
+            fields.append(pa.field(col, pa.int32()))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+
+SCHEMAS = {
+    'articles': arrow_schema(COLUMNS_ARTICLES),
+    'authorship': arrow_schema(COLUMNS_AUTHORSHIP),
+    'affiliations': arrow_schema(COLUMNS_EXPORT_AFFILIATIONS),
+}
+
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PW)
+
+
+def all_years(cur):
+    cur.execute(f"""SELECT DISTINCT EXTRACT(YEAR FROM created)::INTEGER FROM {TABLE_ARTICLE}""")
+    return sorted(row[0] for row in cur.fetchall())
+
+
+def pending_changes(cur):
+    """Returns the ids of the recorded changes and the years affected by them"""
+    cur.execute(f"""SELECT change_id, year FROM {TABLE_EXPORT_CHANGES}""")
+    rows = cur.fetchall()
+    return [row[0] for row in rows], sorted({row[1] for row in rows})
+
+
+def consume_changes(cur, change_ids):
+    """Only the changes read before the export are removed, those recorded in the meantime are kept for the next run"""
+    cur.execute(f"""DELETE FROM {TABLE_EXPORT_CHANGES} WHERE change_id = ANY(%s)""", (change_ids,))
+
+
+def remove_state():
+    """Removed before a full export, so that an interrupted one is repeated by the next run"""
+    if os.path.exists(FILE_EXPORT_STATE):
+        os.remove(FILE_EXPORT_STATE)
+
+
+def partition_dir(table, year):
+    return os.path.join(EXPORT_DIR, table, f'year={year}')
+
+
+def remove_stale_partitions(years):
+    """Removes the partitions of years without articles, after the partitions of 'years' have been written"""
+    current = {f'year={year}' for year in years}
+    for table in EXPORT_QUERIES:
+        table_dir = os.path.join(EXPORT_DIR, table)
+        if not os.path.isdir(table_dir):
+            continue
+        for name in os.listdir(table_dir):
+            if name.startswith('year=') and name not in current:
+                shutil.rmtree(os.path.join(table_dir, name), ignore_errors=True)
+
+
+def write_partition(df, table, year):
+    directory = partition_dir(table, year)
+    if df.empty:
+        shutil.rmtree(directory, ignore_errors=True)
+        return
+    os.makedirs(directory, exist_ok=True)
+    arrow_table = pa.Table.from_pandas(df, schema=SCHEMAS[table], preserve_index=False)
+    tmp_path = os.path.join(directory, 'data.parquet.tmp')
+    pq.write_table(arrow_table, tmp_path)
+    os.replace(tmp_path, os.path.join(directory, 'data.parquet'))  # readers never see partially written files
+
+
+def export_year(conn, year):
+    s = datetime.now()
+    params = {'begin': date(year, 1, 1), 'end': date(year + 1, 1, 1), 'year': year}
+    counts = []
+    # one read-only snapshot for all tables, so that the partitions of a year are consistent
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    try:
+        for table, query in EXPORT_QUERIES.items():
+            df = pd.read_sql(query, conn, params=params)
+            write_partition(df, table, year)
+            counts.append('{} {}'.format(len(df), table))
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level='READ COMMITTED', readonly=False)
+    print('  {} elapsed for export of year {} ({})'.format(datetime.now() - s, year, ', '.join(counts)))
+
+
+def export_snapshots(full=False):
+    begin = datetime.now()
+    full = full or not os.path.exists(FILE_EXPORT_STATE)
+
+    conn = None
+    try:
+        conn = connect()
+        cur = conn.cursor()
+        change_ids, years = pending_changes(cur)
+        if full:
+            years = all_years(cur)
+            remove_state()
+        conn.commit()
+
+        print('{} ##### Begin {} export of {} years'.format(datetime.now(), 'full' if full else 'incremental',
+                                                            len(years)))
+        for year in years:
+            export_year(conn, year)
+        if full:
+            remove_stale_partitions(years)
+
+        consume_changes(cur, change_ids)
+        conn.commit()
+        cur.close()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with open(FILE_EXPORT_STATE, 'w') as fp:
+        json.dump({'exported': datetime.now().isoformat(), 'years': years, 'full': full}, fp)
+    print('{} ***** End export, {} elapsed'.format(datetime.now(), datetime.now() - begin))
+
+
+if __name__ == '__main__':
+    export_snapshots('--full' in sys.argv[1:])
@@ -1,44 +1,49 @@
 import io
 import re
+import sys
+from collections import Counter
 from datetime import datetime
 
-import boto3
 import pandas as pd
 import psycopg2
-from sqlalchemy import create_engine
 
-from config import AWS_S3_BUCKET, DB_USER, DB_PW, DB_HOST, DB_PORT, DB_NAME
-from db_constants import COLUMNS_ARTICLES, COLUMNS_AUTHORSHIP, COLUMNS_AFFILIATIONS, TABLE_ARTICLE, \
-    TABLE_AUTHORSHIP, TABLE_AFFILIATION
-from helpers import extract_first_and_middle_name, replace_umlauts
-from naive_s3_lock import NaiveS3Lock
-
-LOCAL_BUFFER_DIR = "/tmp/"
+from config import DB_USER, DB_PW, DB_HOST, DB_PORT, DB_NAME, PARTITION_BY_YEAR
+from db_aggregates import subtract_author_stats, add_author_stats, apply_author_stats
+from db_constants import COLUMNS_ARTICLES, COLUMNS_AUTHORSHIP, COLUMNS_AFFILIATIONS, COLUMNS_CATEGORIES, \
+    COLUMNS_AUTHOR_AFFILIATIONS, TABLE_ARTICLE, TABLE_AUTHORSHIP, TABLE_AUTHOR_AFFILIATIONS, TABLE_AFFILIATION_NAMES, \
+    TABLE_CATEGORIES, TABLE_IMPORT_LEDGER, COLUMNS_LEDGER_COUNTS, TABLE_EXPORT_CHANGES, COLUMN_YEAR
+from db_leases import worker_name, ensure_shards, acquire_leases, renew_leases, release_leases
+from db_search import SEARCH_VECTOR
+from helpers import extract_first_and_middle_name, replace_umlauts, split_categories, shard_of
+from object_store import get_store
 
 COLUMN_RENAMING = {'acm-class': 'acm_class', 'msc-class': 'msc_class', 'setSpec': 'set_spec',
                    'journal-ref': 'journal_ref', 'report-no': 'report_no'}
 
-ENGINE = create_engine('postgresql://%s:%s@%s:%s/%s' % (DB_USER, DB_PW, DB_HOST, DB_PORT, DB_NAME))
-
-LOCK = NaiveS3Lock(AWS_S3_BUCKET, 'importer.lock')
+# Articles are partitioned into shards by their identifier, each shard is imported by at most one worker at a time.
+# DO NOT CHANGE while files are waiting to be imported, the progress of the import is recorded per shard.
+N_SHARDS = 8
 
 PREFIX_FILE = 'metadata/'
 PREFIX_FILE_DELETIONS = 'missing_metadata/'
-ARCHIVE_FOLDER = 'finished_metadata/'
-ARCHIVE_FOLDER_DELETIONS = 'finished_missing_metadata/'
 
-s3 = boto3.resource('s3')
-BUCKET = s3.Bucket(AWS_S3_BUCKET)
+STORE = get_store()
+
+AFFILIATION_NAME_IDS = {}  # cache {affiliation: affiliation_name_id}, filled by resolve_affiliation_name_ids
 
 
-def import_json_dump_into_db(filename):
+def import_json_dump_into_db(obj, worker, leased_shards, shards):
     begin = datetime.now()
+    filename = obj.key
 
-    print('{} ##### Begin import of file {}'.format(datetime.now(), filename))
+    print('{} ##### Begin import of file {} for shards {}'.format(datetime.now(), filename, shards))
 
-    local_file_path = download_json_file(filename)
+    df = select_shards(df_from_json_file(filename), shards)
 
-    df = df_from_json_file(local_file_path)
+    if df.empty:
+        apply_in_transaction(obj, worker, leased_shards, shards, None)
+        print('{} ***** End import of file {} (no articles in shards)'.format(datetime.now(), filename))
+        return
 
     ids = df['identifier'].values.tolist()  # collect all IDs to delete them before insertion
 
@@ -48,29 +53,36 @@ def import_json_dump_into_db(filename):
 
     df_articles = prepare_articles_df(df_filtered)
 
+    df_categories = prepare_categories_df(df_articles)
+
     df_authors_and_affiliations = prepare_authors_and_affiliations_df(df_filtered)
 
     df_authors = prepare_authors_df(df_authors_and_affiliations)
 
     df_affiliations = prepare_affiliations(df_authors_and_affiliations)
 
-    print('  {} elapsed for preparation of data'.format(datetime.now() - begin))
+    df_affiliations = add_affiliation_name_ids(df_affiliations)
 
-    apply_changes_to_db(ids, df_articles, df_authors, df_affiliations)
+    if PARTITION_BY_YEAR:
+        df_categories, df_authors, df_affiliations = [add_year_column(data_frame, df_articles) for data_frame in
+                                                      (df_categories, df_authors, df_affiliations)]
 
-    move_file_to_folder(filename, ARCHIVE_FOLDER)
+    print('  {} elapsed for preparation of data'.format(datetime.now() - begin))
+
+    apply_in_transaction(obj, worker, leased_shards, shards, apply_changes_to_db,
+                         ids, df_articles, df_categories, df_authors, df_affiliations)
 
     print('{} ***** End import of file {}'.format(datetime.now(), filename))
 
 
-def download_json_file(filename):
-    local_filename = LOCAL_BUFFER_DIR + filename.split('/')[-1]
-    BUCKET.download_file(filename, local_filename)
-    return local_filename
+def df_from_json_file(filename):
+    """Reads the file directly from the store, without a local copy"""
+    with STORE.open_text(filename) as stream:
+        return pd.read_json(stream, orient="columns")
 
 
-def df_from_json_file(local_filename):
-    return pd.read_json('file://localhost' + local_filename, orient="columns")
+def select_shards(df, shards):
+    return df[df.identifier.map(lambda identifier: shard_of(identifier, N_SHARDS) in shards)]
 
 
 def remove_old_versions(df):
@@ -94,6 +106,16 @@ def clean_whitespaces_and_line_breaks():
     return lambda x: re.sub(r"\s+", ' ', x) if isinstance(x, str) else x
 
 
+def prepare_categories_df(df_articles):
+    """takes DF of articles and returns one row per (article, category)"""
+    flat = []
+    for identifier, categories in zip(df_articles.identifier, df_articles.categories):
+        for category, archive, is_primary in split_categories(categories):
+            flat.append({'article_id': identifier, 'category': category, 'archive': archive, 'is_primary': is_primary})
+    data_frame = pd.DataFrame(flat)
+    return add_expected_columns(data_frame, COLUMNS_CATEGORIES)
+
+
 def add_expected_columns(df, columns):
     data_frame = pd.DataFrame(df)
     for col in columns:
@@ -134,96 +156,279 @@ def prepare_affiliations(df):
         for aff in affs:
             flat.append(
                 {**{'article_id': item['article_id']}, **{'author_pos': item['author_pos']}, **{'affiliation': aff}})
-    data_frame = pd.DataFrame(flat)
-    return add_expected_columns(data_frame, COLUMNS_AFFILIATIONS)
+    data_frame = add_expected_columns(pd.DataFrame(flat), COLUMNS_AFFILIATIONS)
+    data_frame.affiliation = data_frame.affiliation.map(clean_whitespaces_and_line_breaks())
+    return data_frame[pd.notnull(data_frame.affiliation)]
+
+
+def add_year_column(df, df_articles):
+    """Adds the year of creation of the articles as partitioning column, see PARTITION_BY_YEAR"""
+    years = dict(zip(df_articles.identifier, pd.to_datetime(df_articles.created).dt.year))
+    df[COLUMN_YEAR] = df.article_id.map(years)
+    return df
+
 
+def partition_columns(columns):
+    """The columns to insert into a table, including the partitioning column if the tables are partitioned"""
+    return columns + [COLUMN_YEAR] if PARTITION_BY_YEAR else columns
 
-def apply_changes_to_db(ids, df_articles, df_authors, df_affiliations):
-    delete_from_db(ids)
-    insert_into_table(df_articles, TABLE_ARTICLE, COLUMNS_ARTICLES)
-    insert_into_table(df_authors, TABLE_AUTHORSHIP, COLUMNS_AUTHORSHIP)
-    insert_into_table(df_affiliations, TABLE_AFFILIATION, COLUMNS_AFFILIATIONS)
 
+def add_affiliation_name_ids(df_affiliations):
+    resolve_affiliation_name_ids(df_affiliations.affiliation.unique().tolist())
+    df_affiliations['affiliation_name_id'] = df_affiliations.affiliation.map(AFFILIATION_NAME_IDS)
+    return df_affiliations
 
-def delete_from_db(ids):
+
+def resolve_affiliation_name_ids(names):
+    """Adds the ids of the affiliation names to the cache 'AFFILIATION_NAME_IDS'.
+    Names not yet in the database are inserted into the dictionary table in bulk."""
+    # sorted, so that concurrent workers insert common names in the same order and cannot deadlock
+    missing = sorted(name for name in names if name not in AFFILIATION_NAME_IDS)
+    if len(missing) == 0:
+        return
     s = datetime.now()
 
-    id_lst = "'" + "','".join(ids) + "'"
+    conn = None
+    try:
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PW)
+        cur = conn.cursor()
+        cur.execute(f"""
+            INSERT INTO {TABLE_AFFILIATION_NAMES} (affiliation)
+            SELECT unnest(%s)
+            ON CONFLICT (affiliation) DO NOTHING
+            """, (missing,))
+        count = cur.rowcount
+        cur.execute(f"""
+            SELECT affiliation, affiliation_name_id FROM {TABLE_AFFILIATION_NAMES} WHERE affiliation = ANY(%s)
+            """, (missing,))
+        AFFILIATION_NAME_IDS.update(cur.fetchall())
+        conn.commit()
+        cur.close()
+    finally:
+        if conn is not None:
+            conn.close()
+    print('  {} elapsed for resolution of {} affiliation names ({} new)'.format(datetime.now() - s, len(missing),
+                                                                               count))
 
-    # data sets in dependent tables will be deleted as well because of cascading
-    command = ("""DELETE FROM %s WHERE identifier IN (%s)""" % (TABLE_ARTICLE, id_lst))
+
+def apply_in_transaction(obj, worker, leased_shards, shards, apply, *args):
+    """Calls 'apply' with a cursor and 'args' and records the import of the file 'obj' for 'shards' in the ledger
+    in one transaction. The leases on 'leased_shards' are renewed and locked at its beginning, so changes are only
+    committed if they have not been taken over by another worker in the meantime."""
     conn = None
     try:
         conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PW)
         cur = conn.cursor()
-        cur.execute(command)
+        renew_leases(cur, worker, leased_shards)
+        article_ids = apply(cur, *args) if apply is not None else {}
+        record_in_ledger(cur, obj, shards, article_ids)
         conn.commit()
-        count = cur.rowcount
         cur.close()
     finally:
         if conn is not None:
             conn.close()
-    print('  {} elapsed for deletion of old versions ({} articles)'.format(datetime.now() - s, count))
 
 
-def move_file_to_folder(file, folder):
-    target_key = folder + file.split('/')[-1]
-    s3.Object(AWS_S3_BUCKET, target_key).copy_from(CopySource=AWS_S3_BUCKET + '/' + file)
-    s3.Object(AWS_S3_BUCKET, file).delete()
-    print('  Moved file {} to {}'.format(file, target_key))
+def record_in_ledger(cur, obj, shards, article_ids):
+    """'article_ids' maps the count columns of the ledger to the article ids of the affected rows"""
+    counts = {col: Counter(shard_of(article_id, N_SHARDS) for article_id in article_ids.get(col, []))
+              for col in COLUMNS_LEDGER_COUNTS}
+    cols = ', '.join(COLUMNS_LEDGER_COUNTS)
+    placeholders = ', '.join(['%s'] * (4 + len(COLUMNS_LEDGER_COUNTS)))
+    cur.executemany(f"""
+        INSERT INTO {TABLE_IMPORT_LEDGER} (file_key, shard, etag, size, {cols})
+        VALUES ({placeholders})
+        """, [(obj.key, shard, obj.etag, obj.size, *[counts[col][shard] for col in COLUMNS_LEDGER_COUNTS])
+              for shard in shards])
+
+
+def imported_shards(keys):
+    """Returns {(file_key, etag): {shards}} for the files 'keys' according to the ledger."""
+    imported = {}
+    if len(keys) == 0:
+        return imported
+    conn = None
+    try:
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PW)
+        cur = conn.cursor()
+        cur.execute(f"""SELECT file_key, shard, etag FROM {TABLE_IMPORT_LEDGER} WHERE file_key = ANY(%s)""",
+                    (list(keys),))
+        for file_key, shard, etag in cur.fetchall():
+            imported.setdefault((file_key, etag), set()).add(shard)
+        cur.close()
+    finally:
+        if conn is not None:
+            conn.close()
+    return imported
+
+
+def apply_changes_to_db(cur, ids, df_articles, df_categories, df_authors, df_affiliations):
+    deleted = delete_from_db(cur, ids)
+    insert_articles(cur, df_articles)
+    insert_into_table(cur, df_categories, TABLE_CATEGORIES, partition_columns(COLUMNS_CATEGORIES))
+    insert_into_table(cur, df_authors, TABLE_AUTHORSHIP, partition_columns(COLUMNS_AUTHORSHIP))
+    insert_into_table(cur, df_affiliations, TABLE_AUTHOR_AFFILIATIONS, partition_columns(COLUMNS_AUTHOR_AFFILIATIONS))
+    update_aggregates(cur, ids)
+    return {'n_deleted': deleted, 'n_articles': df_articles.identifier, 'n_authorships': df_authors.article_id,
+            'n_affiliations': df_affiliations.article_id}
+
+
+def insert_articles(cur, df_articles):
+    """Articles are copied into a staging table first and inserted from there,
+    so that their search vector is computed and the change is recorded for the export in the same statement"""
+    staging_table = TABLE_ARTICLE + '_staging'
+    cols = ', '.join(COLUMNS_ARTICLES)
+    cur.execute(f"""
+        CREATE TEMPORARY TABLE {staging_table} ON COMMIT DROP AS
+        SELECT {cols} FROM {TABLE_ARTICLE} WITH NO DATA
+        """)
+    insert_into_table(cur, df_articles, staging_table, COLUMNS_ARTICLES)
+    # the partitioning column is derived from 'created' as in 'add_year_column'
+    year_col, year_value = (f', {COLUMN_YEAR}', ', EXTRACT(YEAR FROM created)') if PARTITION_BY_YEAR else ('', '')
+    cur.execute(f"""
+        WITH inserted AS (
+            INSERT INTO {TABLE_ARTICLE} ({cols}, search_vector{year_col})
+            SELECT {cols}, {SEARCH_VECTOR}{year_value} FROM {staging_table}
+            RETURNING identifier, created)
+        INSERT INTO {TABLE_EXPORT_CHANGES} (identifier, year)
+        SELECT identifier, EXTRACT(YEAR FROM created) FROM inserted
+        """)
+
+
+def apply_deletions_to_db(cur, ids):
+    deleted = delete_from_db(cur, ids)
+    apply_author_stats(cur)
+    return {'n_deleted': deleted}
+
+
+def delete_from_db(cur, ids):
+    """Returns the identifiers of the deleted articles"""
+    s = datetime.now()
+
+    id_lst = "'" + "','".join(ids) + "'"
+
+    # data sets in dependent tables will be deleted as well because of cascading
+    # the deletion is recorded for the export as well
+    command = ("""
+        WITH deleted AS (DELETE FROM %s WHERE identifier IN (%s) RETURNING identifier, created)
+        INSERT INTO %s (identifier, year)
+        SELECT identifier, EXTRACT(YEAR FROM created) FROM deleted
+        RETURNING identifier
+        """ % (TABLE_ARTICLE, id_lst, TABLE_EXPORT_CHANGES))
+    subtract_author_stats(cur, ids)  # aggregates must be updated before the old versions are gone
+    cur.execute(command)
+    deleted = [row[0] for row in cur.fetchall()]
+    print('  {} elapsed for deletion of old versions ({} articles)'.format(datetime.now() - s, len(deleted)))
+    return deleted
+
+
+def update_aggregates(cur, ids):
+    s = datetime.now()
+    add_author_stats(cur, ids)
+    apply_author_stats(cur)  # serializes concurrent workers until commit, hence the last step of a transaction
+    print('  {} elapsed for update of aggregate tables'.format(datetime.now() - s))
 
 
-def handle_deletions(filename):
+def handle_deletions(obj, worker, leased_shards, shards):
     # deletions are stored in separate files ('missing_metadata*') -> delete IDs AFTER handling of other documents
+    filename = obj.key
 
-    print('{} ##### Begin import of deletions file {}'.format(datetime.now(), filename))
-
-    local_file_path = download_json_file(filename)
-    df = df_from_json_file(local_file_path)
-    delete_from_db(df['identifier'].values.tolist())
+    print('{} ##### Begin import of deletions file {} for shards {}'.format(datetime.now(), filename, shards))
 
-    move_file_to_folder(filename, ARCHIVE_FOLDER_DELETIONS)
+    df = select_shards(df_from_json_file(filename), shards)
+    apply_in_transaction(obj, worker, leased_shards, shards, apply_deletions_to_db,
+                         df['identifier'].values.tolist())
 
     print('{} ***** End import of deletions file {}'.format(datetime.now(), filename))
 
 
-def do_import():
-    LOCK.lock()
+def acquire_shards(worker, max_shards):
+    conn = None
+    try:
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PW)
+        cur = conn.cursor()
+        ensure_shards(cur, N_SHARDS)
+        shards = acquire_leases(cur, worker, N_SHARDS, max_shards)
+        conn.commit()
+        cur.close()
+    finally:
+        if conn is not None:
+            conn.close()
+    return shards
 
-    for obj in BUCKET.objects.filter(Prefix=PREFIX_FILE, Delimiter='/'):
-        import_json_dump_into_db(obj.key)
 
-    for obj in BUCKET.objects.filter(Prefix=PREFIX_FILE_DELETIONS, Delimiter='/'):
-        handle_deletions(obj.key)
+def release_shards(worker, shards):
+    conn = None
+    try:
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PW)
+        cur = conn.cursor()
+        release_leases(cur, worker, shards)
+        conn.commit()
+        cur.close()
+    finally:
+        if conn is not None:
+            conn.close()
 
-    LOCK.unlock()
 
+def import_pending_files(prefix, import_file, worker, leased_shards):
+    """Imports the files listed with 'prefix' for those of the 'leased_shards' for which they are not in the ledger.
+    Files are identified by key and ETag, so a file rewritten under the same key (e.g. when the harvester fetches
+    a batch date again) is imported again."""
+    objects = STORE.list_objects(prefix)
+    imported = imported_shards([obj.key for obj in objects])
+    for obj in objects:
+        done = imported.get((obj.key, obj.etag), set())
+        if any(key == obj.key and etag != obj.etag for key, etag in imported):
+            print('  File {} has changed since its last import, importing it again'.format(obj.key))
+        shards = [shard for shard in leased_shards if shard not in done]
+        if len(shards) > 0:
+            import_file(obj, worker, leased_shards, shards)
+
+
+def do_import(max_shards=N_SHARDS):
+    """Imports all pending files for the shards this worker obtains a lease on.
+    Several workers can run at the same time, each one handling at most 'max_shards' shards.
+    The files are imported in the order in which they are listed, so that for each article
+    newer versions replace older ones. If the import of a file fails, the worker stops and the
+    file is imported again for the affected shards by the next worker.
+    Imported files are left in place, see 'archive_imported_files.py'."""
+    worker = worker_name()
+    AFFILIATION_NAME_IDS.clear()  # the cache is kept for one run only
+
+    shards = acquire_shards(worker, max_shards)
+    if len(shards) == 0:
+        print('{} No free shards, all are leased by other workers'.format(datetime.now()))
+        return
+    print('{} Worker {} acquired shards {}'.format(datetime.now(), worker, shards))
 
-def lambda_handler(event, context):
-    """lambda handler syntax; requires event and context variables"""
-    do_import()
+    try:
+        import_pending_files(PREFIX_FILE, import_json_dump_into_db, worker, shards)
+        import_pending_files(PREFIX_FILE_DELETIONS, handle_deletions, worker, shards)
+    finally:
+        release_shards(worker, shards)
 
 
-if __name__ == '__main__':
-    do_import()
+def lambda_handler(event, context):
+    """lambda handler syntax; requires event and context variables"""
+    do_import((event or {}).get('max_shards', N_SHARDS))
 
 
-def insert_into_table(df, table_name, columns):
+def insert_into_table(cur, df, table_name, columns):
     """Inspired by: https://stackoverflow.com/a/47984180/7740194"""
 
     df_ordered = df[columns]  # ensure column order
     s = datetime.now()
 
-    conn = ENGINE.raw_connection()
-    with conn.cursor() as cur:
-        output = io.StringIO()
-        df_ordered.to_csv(output, index=False)
-        output.seek(0)
-        # contents = output.getvalue()
+    output = io.StringIO()
+    df_ordered.to_csv(output, index=False)
+    output.seek(0)
 
-        cols = ', '.join([f'{col}' for col in columns])
-        sql = f'COPY {table_name} ({cols}) FROM STDIN WITH (FORMAT CSV, HEADER TRUE)'
-        cur.copy_expert(sql, output)
-        count = cur.rowcount
-    conn.commit()
+    cols = ', '.join([f'{col}' for col in columns])
+    sql = f'COPY {table_name} ({cols}) FROM STDIN WITH (FORMAT CSV, HEADER TRUE)'
+    cur.copy_expert(sql, output)
+    count = cur.rowcount
     print('  {} elapsed for insertion of {} rows into table {}'.format(datetime.now() - s, count, table_name))
+
+
+if __name__ == '__main__':
+    do_import(int(sys.argv[1]) if len(sys.argv) > 1 else N_SHARDS)
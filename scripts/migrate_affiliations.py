@@ -0,0 +1,50 @@
+# Move the affiliation strings of an existing database into the dictionary table 'arxiv_affiliation_names'.
+# The table 'arxiv_affiliations' is replaced by 'arxiv_author_affiliations', which references the names by id,
+# and a view 'arxiv_affiliations' with the former columns. The whitespaces of the names are normalized
+# in the same way as by 'clean_whitespaces_and_line_breaks' in the importer.
+# Run it once while the importer is not running.
+
+from datetime import datetime
+
+from config import DB_HOST, DB_PORT, DB_NAME
+from config_db_admin import DB_ADMIN_PW, DB_ADMIN_USER
+from db_helpers import execute_commands
+from scripts.prepare_database import CREATE_AFFILIATION_NAMES, CREATE_AUTHOR_AFFILIATIONS, \
+    CREATE_AUTHOR_AFFILIATIONS_INDEX, CREATE_AFFILIATIONS_VIEW, grant_to_non_admin_user
+
+
+def migrate_affiliations():
+    commands = (
+        CREATE_AFFILIATION_NAMES,
+        r"""
+        INSERT INTO arxiv_affiliation_names (affiliation)
+        SELECT DISTINCT regexp_replace(affiliation, '\s+', ' ', 'g')
+          FROM arxiv_affiliations
+         WHERE affiliation IS NOT NULL
+        """,
+        CREATE_AUTHOR_AFFILIATIONS,
+        r"""
+        INSERT INTO arxiv_author_affiliations (affiliation_id, article_id, author_pos, affiliation_name_id)
+        SELECT a.affiliation_id, a.article_id, a.author_pos, an.affiliation_name_id
+          FROM arxiv_affiliations a
+          JOIN arxiv_affiliation_names an ON an.affiliation = regexp_replace(a.affiliation, '\s+', ' ', 'g')
+        """,
+        """
+        SELECT setval(pg_get_serial_sequence('arxiv_author_affiliations', 'affiliation_id'),
+                      COALESCE(MAX(affiliation_id), 0) + 1, false)
+          FROM arxiv_author_affiliations
+        """,
+        """DROP TABLE arxiv_affiliations""",
+        CREATE_AUTHOR_AFFILIATIONS_INDEX,
+        CREATE_AFFILIATIONS_VIEW,
+        """ANALYZE arxiv_affiliation_names""",
+        """ANALYZE arxiv_author_affiliations""",
+    )
+    s = datetime.now()
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
+    print('{} elapsed for migration of affiliations'.format(datetime.now() - s))
+
+
+if __name__ == '__main__':
+    migrate_affiliations()
+    grant_to_non_admin_user()
@@ -0,0 +1,15 @@
+# Add the tables of the concurrent importer (leases, import ledger and export changes) to an existing database,
+# as well as the index on 'created' used by 'export_snapshots.py' (not needed for tables partitioned by year).
+# Existing tables and indexes are kept, so the script can be run repeatedly. Run it before deploying the new importer.
+
+from config import DB_HOST, DB_PORT, DB_NAME, PARTITION_BY_YEAR
+from config_db_admin import DB_ADMIN_PW, DB_ADMIN_USER
+from db_helpers import execute_commands
+from scripts.prepare_database import CREATE_ARTICLES_CREATED_INDEX, create_import_tables, grant_to_non_admin_user
+
+
+if __name__ == '__main__':
+    create_import_tables()
+    if not PARTITION_BY_YEAR:
+        execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, (CREATE_ARTICLES_CREATED_INDEX,))
+    grant_to_non_admin_user()
@@ -0,0 +1,129 @@
+# Management of the tables partitioned by year (see 'prepare_database.py'):
+#     partition_tables.py migrate        moves an existing database to the partitioned layout
+#     partition_tables.py add <year>     creates the partitions for all years up to <year>
+#     partition_tables.py vacuum <year>  vacuums and analyzes the partitions of <year>, one table at a time
+#     partition_tables.py check          reports identifiers stored more than once
+# Primary keys of partitioned tables must include the partitioning column, hence the database no longer
+# enforces the uniqueness of 'identifier' in the partitioned layout. The importer keeps it, since it deletes
+# the former versions of an article in all partitions before inserting the new one, but rows written otherwise
+# are not checked; use 'check' to find such duplicates.
+# Set PARTITION_BY_YEAR in 'config.py' to True after the migration, so that the importer fills 'article_year'.
+# The migration runs in one transaction and requires the importer to be stopped.
+
+import sys
+from datetime import datetime
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from config import DB_HOST, DB_PORT, DB_NAME
+from config_db_admin import DB_ADMIN_PW, DB_ADMIN_USER
+from db_constants import COLUMNS_ARTICLES, COLUMNS_AUTHORSHIP, COLUMNS_AUTHOR_AFFILIATIONS, COLUMNS_CATEGORIES, \
+    COLUMN_YEAR
+from db_helpers import open_connection, close_connection, execute_commands
+from scripts.prepare_database import PARTITIONED_TABLES, CREATE_PARTITIONED_TABLES, PARTITIONED_CONSTRAINTS, \
+    CREATE_AFFILIATIONS_VIEW, create_year_partitions_commands, partition_years, grant_to_non_admin_user
+
+SUFFIX_UNPARTITIONED = '_unpartitioned'
+
+
+def copy_command(table, columns, article_id_column):
+    """Copies the rows of the renamed unpartitioned table, with the year of the article as partitioning column"""
+    cols = ', '.join(columns)
+    return f"""
+        INSERT INTO {table} ({cols}, {COLUMN_YEAR})
+        SELECT {', '.join('t.' + col for col in columns)}, EXTRACT(YEAR FROM ar.created)
+          FROM {table}{SUFFIX_UNPARTITIONED} t
+          JOIN arxiv_articles{SUFFIX_UNPARTITIONED} ar ON ar.identifier = t.{article_id_column}
+        """
+
+
+def duplicate_identifiers():
+    """Returns the identifiers stored more than once with the years of their rows"""
+    conn, cursor = open_connection(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW)
+    try:
+        cursor.execute(f"""
+            SELECT identifier, array_agg({COLUMN_YEAR} ORDER BY {COLUMN_YEAR})
+              FROM arxiv_articles
+             GROUP BY identifier
+            HAVING COUNT(*) > 1
+             ORDER BY identifier
+            """)
+        return cursor.fetchall()
+    finally:
+        close_connection(conn)
+
+
+def migrate():
+    commands = (
+        """DROP VIEW arxiv_affiliations""",
+        *[f"""ALTER TABLE {table} RENAME TO {table}{SUFFIX_UNPARTITIONED}""" for table in PARTITIONED_TABLES],
+        *CREATE_PARTITIONED_TABLES,
+        *create_year_partitions_commands(partition_years(), default=True),
+        copy_command('arxiv_articles', COLUMNS_ARTICLES + ['search_vector'], 'identifier'),
+        copy_command('arxiv_authorship', COLUMNS_AUTHORSHIP, 'article_id'),
+        copy_command('arxiv_author_affiliations', ['affiliation_id'] + COLUMNS_AUTHOR_AFFILIATIONS, 'article_id'),
+        copy_command('arxiv_article_categories', COLUMNS_CATEGORIES, 'article_id'),
+        """
+        SELECT setval(pg_get_serial_sequence('arxiv_author_affiliations', 'affiliation_id'),
+                      COALESCE(MAX(affiliation_id), 0) + 1, false)
+          FROM arxiv_author_affiliations
+        """,
+        # dependent tables first because of the foreign keys
+        *[f"""DROP TABLE {table}{SUFFIX_UNPARTITIONED}""" for table in reversed(PARTITIONED_TABLES)],
+        *PARTITIONED_CONSTRAINTS,
+        CREATE_AFFILIATIONS_VIEW,
+        *[f"""ANALYZE {table}""" for table in PARTITIONED_TABLES],
+    )
+    s = datetime.now()
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
+    grant_to_non_admin_user()
+    print('{} elapsed for migration to tables partitioned by year'.format(datetime.now() - s))
+
+
+def add_partitions(last_year):
+    """Creates the missing partitions up to 'last_year', run it before the turn of the year"""
+    conn, cursor = open_connection(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW)
+    try:
+        cursor.execute("""
+            SELECT c.relname
+              FROM pg_inherits i
+              JOIN pg_class c ON c.oid = i.inhrelid
+              JOIN pg_class p ON p.oid = i.inhparent
+             WHERE p.relname = 'arxiv_articles'
+            """)
+        existing = {row[0] for row in cursor.fetchall()}
+    finally:
+        close_connection(conn)
+    years = [year for year in range(partition_years().start, last_year + 1) if f'arxiv_articles_{year}' not in existing]
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, create_year_partitions_commands(years))
+    grant_to_non_admin_user()
+    print('Created partitions for years {}'.format(years))
+
+
+def vacuum_year(year):
+    conn, cursor = open_connection(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)  # VACUUM cannot run inside a transaction
+    try:
+        for table in PARTITIONED_TABLES:
+            s = datetime.now()
+            cursor.execute(f"""VACUUM ANALYZE {table}_{year}""")
+            print('  {} elapsed for vacuum of {}_{}'.format(datetime.now() - s, table, year))
+    finally:
+        close_connection(conn)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == 'migrate':
+        migrate()
+    elif len(sys.argv) == 3 and sys.argv[1] == 'add':
+        add_partitions(int(sys.argv[2]))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'vacuum':
+        vacuum_year(int(sys.argv[2]))
+    elif len(sys.argv) == 2 and sys.argv[1] == 'check':
+        duplicates = duplicate_identifiers()
+        for identifier, years in duplicates:
+            print('Identifier {} is stored for the years {}'.format(identifier, years))
+        print('{} identifiers stored more than once'.format(len(duplicates)))
+        sys.exit(1 if duplicates else 0)
+    else:
+        print('Usage: partition_tables.py migrate | add <year> | vacuum <year> | check')
@@ -1,12 +1,196 @@
 #!/usr/bin/python
 
+from datetime import date
+
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, ISOLATION_LEVEL_READ_COMMITTED
 
-from config import DB_HOST, DB_PORT, DB_USER, DB_PW, DB_NAME
+from config import DB_HOST, DB_PORT, DB_USER, DB_PW, DB_NAME, PARTITION_BY_YEAR
 from config_db_admin import DB_ADMIN_DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW
 from db_helpers import execute_commands
 
+# Affiliation strings repeat very often, so they are stored once in a dictionary table
+# and referenced by id. The view 'arxiv_affiliations' provides the original layout for queries.
+CREATE_AFFILIATION_NAMES = """
+    CREATE TABLE arxiv_affiliation_names (
+        affiliation_name_id SERIAL PRIMARY KEY,
+        affiliation VARCHAR NOT NULL UNIQUE -- max found 329, whitespaces normalized
+    )
+    """
+CREATE_AUTHOR_AFFILIATIONS = """
+    CREATE TABLE arxiv_author_affiliations (
+        affiliation_id SERIAL PRIMARY KEY,
+        article_id VARCHAR(31) NOT NULL,
+        author_pos INTEGER NOT NULL,
+        affiliation_name_id INTEGER NOT NULL REFERENCES arxiv_affiliation_names (affiliation_name_id),
+        FOREIGN KEY (article_id, author_pos)
+            REFERENCES arxiv_authorship (article_id, author_pos)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE
+    )
+    """
+CREATE_AUTHOR_AFFILIATIONS_INDEX = """
+    CREATE INDEX article_id_aff_idx
+        ON public.arxiv_author_affiliations (article_id)
+    """
+CREATE_AFFILIATIONS_VIEW = """
+    CREATE VIEW arxiv_affiliations AS
+        SELECT aa.affiliation_id, aa.article_id, aa.author_pos, an.affiliation, aa.affiliation_name_id
+          FROM arxiv_author_affiliations aa
+          JOIN arxiv_affiliation_names an ON an.affiliation_name_id = aa.affiliation_name_id
+    """
+# 'export_snapshots.py' reads the articles year by year, the partitioned layout does not need the index
+# since the export filters on the partitioning column there. Also created by 'migrate_import_tables.py'.
+CREATE_ARTICLES_CREATED_INDEX = """
+    CREATE INDEX IF NOT EXISTS article_created_idx
+        ON public.arxiv_articles (created)
+    """
+# The categories table is also created by 'backfill_categories.py' on existing databases,
+# hence the commands keep existing tables and indexes.
+CREATE_ARTICLE_CATEGORIES = """
+    CREATE TABLE IF NOT EXISTS arxiv_article_categories (
+        article_id VARCHAR(31) NOT NULL,
+        category VARCHAR(31) NOT NULL, -- e.g. 'math.AG', 'hep-th'
+        archive VARCHAR(31) NOT NULL, -- part of the category before the '.', e.g. 'math', 'hep-th'
+        is_primary BOOLEAN NOT NULL, -- first entry of 'categories'
+        CONSTRAINT article_categories_pk PRIMARY KEY (article_id, category),
+        FOREIGN KEY (article_id)
+            REFERENCES arxiv_articles (identifier)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE
+    )
+    """
+CREATE_ARTICLE_CATEGORIES_INDEXES = (
+    """CREATE INDEX IF NOT EXISTS category_idx ON public.arxiv_article_categories (category, article_id)""",
+    """CREATE INDEX IF NOT EXISTS archive_idx ON public.arxiv_article_categories (archive, article_id)""",
+    """
+    CREATE INDEX IF NOT EXISTS primary_category_idx
+        ON public.arxiv_article_categories (category, article_id)
+        WHERE is_primary
+    """,
+)
+
+# Alternative layout with the tables depending on articles partitioned by the year of 'created'
+# (column 'article_year', requires PostgreSQL 12 or later). Queries restricted to years should filter on
+# 'article_year', so that only the relevant partitions are read. Primary keys, foreign keys and indexes are
+# created after the partitions (see PARTITIONED_CONSTRAINTS), so that data can be loaded before.
+# Primary keys must contain the partitioning column, so 'identifier' alone is not unique at database level anymore,
+# see 'partition_tables.py check'.
+FIRST_PARTITION_YEAR = 1991  # articles of other years go into the default partitions
+PARTITIONED_TABLES = ('arxiv_articles', 'arxiv_authorship', 'arxiv_author_affiliations', 'arxiv_article_categories')
+CREATE_PARTITIONED_TABLES = (
+    """
+    CREATE TABLE arxiv_articles (
+        identifier VARCHAR(31) NOT NULL,
+        title VARCHAR NOT NULL,
+        created DATE NOT NULL,
+        categories VARCHAR(255) NOT NULL,
+        datestamp DATE NOT NULL,
+        set_spec VARCHAR(255) NOT NULL,
+        abstract VARCHAR NOT NULL,
+        msc_class VARCHAR(255),
+        acm_class VARCHAR,
+        comments VARCHAR,
+        updated DATE,
+        journal_ref VARCHAR,
+        report_no VARCHAR,
+        doi VARCHAR(255),
+        search_vector TSVECTOR,
+        article_year SMALLINT NOT NULL -- year of 'created'
+    ) PARTITION BY RANGE (article_year)
+    """,
+    """
+    CREATE TABLE arxiv_authorship (
+        article_id VARCHAR(31) NOT NULL,
+        author_pos INTEGER NOT NULL,
+        keyname VARCHAR(255) NOT NULL,
+        forenames VARCHAR(255),
+        suffix VARCHAR(10),
+        first_name VARCHAR(255),
+        middle_name VARCHAR(255),
+        article_year SMALLINT NOT NULL
+    ) PARTITION BY RANGE (article_year)
+    """,
+    """
+    CREATE TABLE arxiv_author_affiliations (
+        affiliation_id SERIAL NOT NULL,
+        article_id VARCHAR(31) NOT NULL,
+        author_pos INTEGER NOT NULL,
+        affiliation_name_id INTEGER NOT NULL,
+        article_year SMALLINT NOT NULL
+    ) PARTITION BY RANGE (article_year)
+    """,
+    """
+    CREATE TABLE arxiv_article_categories (
+        article_id VARCHAR(31) NOT NULL,
+        category VARCHAR(31) NOT NULL,
+        archive VARCHAR(31) NOT NULL,
+        is_primary BOOLEAN NOT NULL,
+        article_year SMALLINT NOT NULL
+    ) PARTITION BY RANGE (article_year)
+    """,
+)
+PARTITIONED_CONSTRAINTS = (
+    """ALTER TABLE arxiv_articles ADD CONSTRAINT articles_pk PRIMARY KEY (identifier, article_year)""",
+    """ALTER TABLE arxiv_authorship ADD CONSTRAINT authorship_pk PRIMARY KEY (article_id, author_pos, article_year)""",
+    """
+    ALTER TABLE arxiv_authorship ADD CONSTRAINT authorship_article_fk
+        FOREIGN KEY (article_id, article_year)
+        REFERENCES arxiv_articles (identifier, article_year)
+        ON UPDATE CASCADE
+        ON DELETE CASCADE
+    """,
+    """
+    ALTER TABLE arxiv_author_affiliations ADD CONSTRAINT author_affiliations_pk
+        PRIMARY KEY (affiliation_id, article_year)
+    """,
+    """
+    ALTER TABLE arxiv_author_affiliations ADD CONSTRAINT author_affiliations_authorship_fk
+        FOREIGN KEY (article_id, author_pos, article_year)
+        REFERENCES arxiv_authorship (article_id, author_pos, article_year)
+        ON UPDATE CASCADE
+        ON DELETE CASCADE
+    """,
+    """
+    ALTER TABLE arxiv_author_affiliations ADD CONSTRAINT author_affiliations_name_fk
+        FOREIGN KEY (affiliation_name_id)
+        REFERENCES arxiv_affiliation_names (affiliation_name_id)
+    """,
+    """
+    ALTER TABLE arxiv_article_categories ADD CONSTRAINT article_categories_pk
+        PRIMARY KEY (article_id, category, article_year)
+    """,
+    """
+    ALTER TABLE arxiv_article_categories ADD CONSTRAINT article_categories_article_fk
+        FOREIGN KEY (article_id, article_year)
+        REFERENCES arxiv_articles (identifier, article_year)
+        ON UPDATE CASCADE
+        ON DELETE CASCADE
+    """,
+    """CREATE INDEX article_search_idx ON public.arxiv_articles USING GIN (search_vector)""",
+    """CREATE INDEX article_id_aff_idx ON public.arxiv_author_affiliations (article_id)""",
+) + CREATE_ARTICLE_CATEGORIES_INDEXES
+
+
+def create_year_partitions_commands(years, default=False):
+    """Commands creating the partitions of all partitioned tables for 'years' and, optionally, the default ones.
+    Partitions must be created before articles of the year are imported, otherwise they end up in the default
+    partition, and creating the partition fails until they have been moved."""
+    commands = []
+    for table in PARTITIONED_TABLES:
+        for year in years:
+            commands.append(f"""
+                CREATE TABLE {table}_{year} PARTITION OF {table} FOR VALUES FROM ({year}) TO ({year + 1})
+                """)
+        if default:
+            commands.append(f"""CREATE TABLE {table}_default PARTITION OF {table} DEFAULT""")
+    return tuple(commands)
+
+
+def partition_years():
+    """Years for which partitions are created initially, including the next one"""
+    return range(FIRST_PARTITION_YEAR, date.today().year + 2)
+
 
 def create_non_admin_user():
     commands = (
@@ -44,10 +228,16 @@ def create_tables_for_arxiv():
             updated DATE, -- date (10)
             journal_ref VARCHAR, -- max found 331
             report_no VARCHAR, -- max found 347 
-            doi VARCHAR(255) -- max found 138 
+            doi VARCHAR(255), -- max found 138 
+            search_vector TSVECTOR -- title and abstract, see 'db_search.py'
           )
         """,
         """
+        CREATE INDEX article_search_idx
+            ON public.arxiv_articles USING GIN (search_vector)
+        """,
+        CREATE_ARTICLES_CREATED_INDEX,
+        """
         CREATE TABLE arxiv_authorship (
             article_id VARCHAR(31) NOT NULL,
             author_pos INTEGER NOT NULL,
@@ -67,22 +257,78 @@ def create_tables_for_arxiv():
         CREATE INDEX article_id_idx
             ON public.arxiv_authorship (article_id)
         """,
+        CREATE_AFFILIATION_NAMES,
+        CREATE_AUTHOR_AFFILIATIONS,
+        CREATE_AUTHOR_AFFILIATIONS_INDEX,
+        CREATE_AFFILIATIONS_VIEW,
+        CREATE_ARTICLE_CATEGORIES,
+    ) + CREATE_ARTICLE_CATEGORIES_INDEXES
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
+
+
+def create_partitioned_tables_for_arxiv():
+    commands = (CREATE_AFFILIATION_NAMES,) + CREATE_PARTITIONED_TABLES + \
+               create_year_partitions_commands(partition_years(), default=True) + \
+               PARTITIONED_CONSTRAINTS + (CREATE_AFFILIATIONS_VIEW,)
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
+
+
+def create_aggregate_tables():
+    """Aggregate tables are maintained incrementally by the importer,
+    use 'refresh_aggregates.py' to rebuild them from the base tables.
+    Existing tables are kept, so that this can be run on existing databases as well."""
+    commands = (
         """
-        CREATE TABLE arxiv_affiliations (
-            affiliation_id SERIAL PRIMARY KEY,
-            article_id VARCHAR(31) NOT NULL,
-            author_pos INTEGER NOT NULL,
-            affiliation VARCHAR, -- max found 329 
-            FOREIGN KEY (article_id, author_pos)
-                REFERENCES arxiv_authorship (article_id, author_pos)
-                ON UPDATE CASCADE 
-                ON DELETE CASCADE
+        CREATE TABLE IF NOT EXISTS arxiv_author_stats (
+            first_name VARCHAR(255) NOT NULL, -- empty string if forenames consist of initials only
+            year INTEGER NOT NULL, -- year of 'created'
+            primary_category VARCHAR(31) NOT NULL, -- first entry of 'categories'
+            author_position VARCHAR(6) NOT NULL, -- 'single', 'first', 'middle' or 'last'
+            author_count INTEGER NOT NULL,
+            CONSTRAINT author_stats_pk PRIMARY KEY (first_name, year, primary_category, author_position)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS author_stats_year_category_idx
+            ON public.arxiv_author_stats (year, primary_category)
+        """,
+    )
+    execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
+
+
+def create_import_tables():
+    """Tables used by the importer to coordinate concurrent workers (see 'db_leases.py'),
+    to keep track of imported files and to record changes for 'export_snapshots.py'.
+    Existing tables are kept, so that this can be run on existing databases as well (see 'migrate_import_tables.py')."""
+    commands = (
+        """
+        CREATE TABLE IF NOT EXISTS arxiv_import_leases (
+            shard INTEGER NOT NULL PRIMARY KEY,
+            worker VARCHAR(255), -- NULL if the shard is free
+            lease_expires TIMESTAMP WITH TIME ZONE -- time of the release if the shard is free
         )
         """,
         """
-        CREATE INDEX article_id_aff_idx
-            ON public.arxiv_affiliations (article_id)
+        CREATE TABLE IF NOT EXISTS arxiv_import_ledger (
+            file_key VARCHAR(255) NOT NULL,
+            shard INTEGER NOT NULL,
+            etag VARCHAR(255) NOT NULL,
+            size BIGINT NOT NULL,
+            n_deleted INTEGER NOT NULL, -- articles deleted, including old versions of updated ones
+            n_articles INTEGER NOT NULL, -- rows inserted per table
+            n_authorships INTEGER NOT NULL,
+            n_affiliations INTEGER NOT NULL,
+            imported TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            CONSTRAINT import_ledger_pk PRIMARY KEY (file_key, etag, shard)
+        )
+        """,
         """
+        CREATE TABLE IF NOT EXISTS arxiv_export_changes (
+            change_id BIGSERIAL PRIMARY KEY,
+            identifier VARCHAR(31) NOT NULL, -- article inserted or deleted by the importer
+            year INTEGER NOT NULL -- year of 'created', i.e. the partition of the snapshot export
+        )
+        """,
     )
     execute_commands(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW, commands)
 
@@ -126,7 +372,12 @@ if __name__ == '__main__':
     create_non_admin_user()
 
     create_database(DB_NAME)
-    create_tables_for_arxiv()
+    if PARTITION_BY_YEAR:
+        create_partitioned_tables_for_arxiv()
+    else:
+        create_tables_for_arxiv()
+    create_aggregate_tables()
+    create_import_tables()
 
     # run after all tables have been created!
     grant_to_non_admin_user()
@@ -0,0 +1,28 @@
+# Rebuild the aggregate tables from the base tables, e.g. on an existing database (the tables are created
+# if they do not exist yet) or after name parts have been re-extracted with 'batch_name_part_extraction.py'.
+# During regular operation the importer keeps them up to date incrementally.
+
+from datetime import datetime
+
+from config import DB_HOST, DB_PORT, DB_NAME
+from config_db_admin import DB_ADMIN_PW, DB_ADMIN_USER
+from db_aggregates import refresh_author_stats
+from db_helpers import open_connection, close_connection
+from scripts.prepare_database import create_aggregate_tables, grant_to_non_admin_user
+
+
+def refresh_aggregates():
+    s = datetime.now()
+    create_aggregate_tables()
+    grant_to_non_admin_user()
+    conn, cursor = open_connection(DB_HOST, DB_PORT, DB_NAME, DB_ADMIN_USER, DB_ADMIN_PW)
+    try:
+        refresh_author_stats(cursor)
+        conn.commit()
+    finally:
+        close_connection(conn)
+    print('{} elapsed for refresh of aggregate tables'.format(datetime.now() - s))
+
+
+if __name__ == '__main__':
+    refresh_aggregates()
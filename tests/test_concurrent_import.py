@@ -0,0 +1,211 @@
+# Concurrent importers against a disposable PostgreSQL database, whose schema 'public' is dropped and recreated.
+# The connection is taken from the environment variables ARXIV_TEST_DB_HOST, ARXIV_TEST_DB_PORT,
+# ARXIV_TEST_DB_NAME, ARXIV_TEST_DB_USER and ARXIV_TEST_DB_PW; the tests are skipped if they are not set.
+
+import json
+import multiprocessing
+import os
+
+import pytest
+
+pytest.importorskip('pandas')
+psycopg2 = pytest.importorskip('psycopg2')
+pytest.importorskip('boto3')
+
+DB_SETTINGS = {name: os.environ.get('ARXIV_TEST_DB_' + name) for name in ('HOST', 'PORT', 'NAME', 'USER', 'PW')}
+
+pytestmark = pytest.mark.skipif(not all(DB_SETTINGS.values()),
+                                reason='ARXIV_TEST_DB_* must point to a disposable PostgreSQL database')
+
+import scripts.archive_imported_files as archive  # noqa: E402
+import scripts.import_file_to_db as importer  # noqa: E402
+import scripts.prepare_database as prepare_database  # noqa: E402
+from db_aggregates import author_stats_source  # noqa: E402
+from db_leases import LeaseLostError, ensure_shards, acquire_leases, renew_leases  # noqa: E402
+from object_store import LocalStore  # noqa: E402
+
+IDENTIFIERS = ['1801.{:05d}'.format(i) for i in range(1, 41)]
+DELETED = IDENTIFIERS[::10]
+N_VERSIONS = 3  # one metadata file per version, each one updating all articles
+
+
+def oai_identifier(identifier):
+    return 'oai:arXiv.org:' + identifier
+
+
+def record(identifier, version):
+    """Record of the metadata files written by 'etl_update_batches.py', version n has n authors"""
+    return {
+        'id': identifier,
+        'identifier': oai_identifier(identifier),
+        'datestamp': '2018-01-0{}'.format(version),
+        'setSpec': 'physics:hep-th',
+        'created': '2018-01-01',
+        'title': 'Title of {}, version {}'.format(identifier, version),
+        'abstract': 'Abstract of {}, version {}'.format(identifier, version),
+        'categories': 'hep-th math.AG',
+        'authors': [{'keyname': 'Author{}'.format(pos), 'forenames': 'Anna Maria',
+                     'affiliation': 'University {}'.format(pos)} for pos in range(1, version + 1)],
+    }
+
+
+def connect():
+    conn = psycopg2.connect(host=DB_SETTINGS['HOST'], port=DB_SETTINGS['PORT'], dbname=DB_SETTINGS['NAME'],
+                            user=DB_SETTINGS['USER'], password=DB_SETTINGS['PW'])
+    conn.autocommit = True
+    return conn
+
+
+def query(sql, params=None):
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def database(monkeypatch, tmp_path):
+    """Empty tables and an empty local store, used by the importer of this process and of forked workers"""
+    settings = {'DB_HOST': DB_SETTINGS['HOST'], 'DB_PORT': DB_SETTINGS['PORT'], 'DB_NAME': DB_SETTINGS['NAME'],
+                'DB_USER': DB_SETTINGS['USER'], 'DB_PW': DB_SETTINGS['PW'],
+                'DB_ADMIN_USER': DB_SETTINGS['USER'], 'DB_ADMIN_PW': DB_SETTINGS['PW']}
+    for module in (prepare_database, importer, archive):
+        for name, value in settings.items():
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, value)
+    monkeypatch.setattr(importer, 'PARTITION_BY_YEAR', False)
+    monkeypatch.setattr(importer, 'STORE', LocalStore(str(tmp_path)))
+    monkeypatch.setattr(archive, 'STORE', importer.STORE)
+
+    conn = connect()
+    try:
+        conn.cursor().execute("""DROP SCHEMA public CASCADE; CREATE SCHEMA public""")
+    finally:
+        conn.close()
+    prepare_database.create_tables_for_arxiv()
+    prepare_database.create_aggregate_tables()
+    prepare_database.create_import_tables()
+    return importer.STORE
+
+
+def put_files(store):
+    for version in range(1, N_VERSIONS + 1):
+        store.put('metadata/2018-01-0{}_0.json'.format(version),
+                  json.dumps([record(identifier, version) for identifier in IDENTIFIERS]))
+    store.put('missing_metadata/2018-01-0{}_0.json'.format(N_VERSIONS),
+              json.dumps([{'identifier': oai_identifier(identifier), 'datestamp': '2018-01-03',
+                           'setSpec': 'physics:hep-th'} for identifier in DELETED]))
+
+
+def run_workers(n_workers, max_shards):
+    """Runs the importers in separate processes, like concurrent invocations of the Lambda"""
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=importer.do_import, args=(max_shards,)) for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * n_workers
+
+
+def test_concurrent_workers_import_latest_versions(database):
+    put_files(database)
+
+    # 3 workers with 3 shards each cover all 8 shards, whether they overlap in time or not
+    run_workers(3, 3)
+
+    ledger = query("""
+        SELECT file_key, COUNT(DISTINCT shard), SUM(n_deleted), SUM(n_articles), SUM(n_authorships),
+               SUM(n_affiliations)
+          FROM arxiv_import_ledger
+         GROUP BY file_key
+         ORDER BY file_key
+        """)
+    n_articles = len(IDENTIFIERS)
+    assert ledger == [
+        ('metadata/2018-01-01_0.json', importer.N_SHARDS, 0, n_articles, n_articles, n_articles),
+        ('metadata/2018-01-02_0.json', importer.N_SHARDS, n_articles, n_articles, 2 * n_articles, 2 * n_articles),
+        ('metadata/2018-01-03_0.json', importer.N_SHARDS, n_articles, n_articles, 3 * n_articles, 3 * n_articles),
+        ('missing_metadata/2018-01-03_0.json', importer.N_SHARDS, len(DELETED), 0, 0, 0),
+    ]
+    per_shard = query("""SELECT shard, COUNT(*) FROM arxiv_import_ledger GROUP BY shard ORDER BY shard""")
+    assert per_shard == [(shard, N_VERSIONS + 1) for shard in range(importer.N_SHARDS)]
+
+    remaining = sorted(set(IDENTIFIERS) - set(DELETED))
+    assert query("""SELECT identifier, title FROM arxiv_articles ORDER BY identifier""") == \
+        [(oai_identifier(identifier), 'Title of {}, version {}'.format(identifier, N_VERSIONS))
+         for identifier in remaining]
+    assert query("""SELECT COUNT(*) FROM arxiv_articles WHERE search_vector IS NULL""") == [(0,)]
+    assert query("""SELECT article_id, COUNT(*) FROM arxiv_authorship GROUP BY article_id ORDER BY article_id""") \
+        == [(oai_identifier(identifier), N_VERSIONS) for identifier in remaining]
+    assert query("""SELECT COUNT(*) FROM arxiv_affiliations""") == [(N_VERSIONS * len(remaining),)]
+    assert query("""SELECT COUNT(*) FROM arxiv_article_categories""") == [(2 * len(remaining),)]
+
+    # the incrementally maintained aggregates match a rebuild from the base tables
+    cols = 'first_name, year, primary_category, author_position, author_count'
+    assert query(f"""SELECT {cols} FROM arxiv_author_stats ORDER BY 1, 2, 3, 4""") == \
+        query(f"""SELECT {cols} FROM ({author_stats_source()}) src ORDER BY 1, 2, 3, 4""")
+
+    # every insertion and deletion is recorded for the export
+    assert query("""SELECT COUNT(*) FROM arxiv_export_changes""") == \
+        [(N_VERSIONS * n_articles + (N_VERSIONS - 1) * n_articles + len(DELETED),)]
+
+    assert query("""SELECT COUNT(*) FROM arxiv_import_leases WHERE worker IS NOT NULL""") == [(0,)]
+
+    # nothing is pending anymore, a further run imports nothing
+    importer.do_import()
+    assert query("""SELECT COUNT(*) FROM arxiv_import_ledger""") == [((N_VERSIONS + 1) * importer.N_SHARDS,)]
+
+
+def test_rewritten_file_is_imported_again(database):
+    put_files(database)
+    importer.do_import()
+
+    # the harvester fetches the last batch date again and rewrites the file under the same key
+    key = 'metadata/2018-01-0{}_0.json'.format(N_VERSIONS)
+    database.put(key, json.dumps([record(identifier, N_VERSIONS + 1) for identifier in IDENTIFIERS]))
+    rewritten = {obj.key: obj for obj in database.list_objects('metadata/')}[key]
+    assert archive.finished_files([rewritten]) == set()
+
+    importer.do_import()
+
+    assert query("""SELECT COUNT(DISTINCT etag), COUNT(*) FROM arxiv_import_ledger WHERE file_key = %s""", (key,)) \
+        == [(2, 2 * importer.N_SHARDS)]
+    assert query("""SELECT DISTINCT title FROM arxiv_articles WHERE identifier = %s""",
+                 (oai_identifier(IDENTIFIERS[1]),)) == \
+        [('Title of {}, version {}'.format(IDENTIFIERS[1], N_VERSIONS + 1),)]
+    assert archive.finished_files([rewritten]) == {key}
+
+
+def test_expired_lease_is_taken_over(database):
+    put_files(database)
+    all_shards = list(range(importer.N_SHARDS))
+
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        ensure_shards(cur, importer.N_SHARDS)
+        assert acquire_leases(cur, 'worker-a', importer.N_SHARDS, importer.N_SHARDS) == all_shards
+        assert acquire_leases(cur, 'worker-b', importer.N_SHARDS, importer.N_SHARDS) == []
+
+        # worker-a stalls until its leases on shards 0 and 1 expire
+        cur.execute("""UPDATE arxiv_import_leases SET lease_expires = now() - INTERVAL '1 minute' WHERE shard < 2""")
+        assert acquire_leases(cur, 'worker-b', importer.N_SHARDS, importer.N_SHARDS) == [0, 1]
+        renew_leases(cur, 'worker-b', [0, 1])
+        with pytest.raises(LeaseLostError):
+            renew_leases(cur, 'worker-a', all_shards)
+    finally:
+        conn.close()
+
+    # worker-a cannot commit anything for its former shards
+    with pytest.raises(LeaseLostError):
+        importer.import_pending_files(importer.PREFIX_FILE, importer.import_json_dump_into_db, 'worker-a', all_shards)
+    assert query("""SELECT COUNT(*) FROM arxiv_articles""") == [(0,)]
+    assert query("""SELECT COUNT(*) FROM arxiv_import_ledger""") == [(0,)]
+
+    # while worker-b imports the files for the shards it took over
+    importer.import_pending_files(importer.PREFIX_FILE, importer.import_json_dump_into_db, 'worker-b', [0, 1])
+    assert query("""SELECT DISTINCT shard FROM arxiv_import_ledger ORDER BY shard""") == [(0,), (1,)]